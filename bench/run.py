@@ -0,0 +1,324 @@
+"""
+Нагрузочный тест бота без сети.
+
+Поднимает настоящее aiohttp-приложение из main.create_app(), направляет Bot API
+и OpenAI на локальные заглушки и шлёт синтетические апдейты на WEBHOOK_PATH
+с заданной частотой. Результат — JSON с перцентилями задержки, пропускной
+способностью, приростом памяти и числом повторных ответов.
+
+    python -m bench.run --rate 20 --duration 30 --json bench.json
+    python -m bench.run --stream --baseline bench.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import socket
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from bench.stubs import OpenAIStub, TelegramStub
+
+TELEGRAM_TOKEN = "123456:bench"
+LOG_BOT_TOKEN = "654321:bench"
+LOG_CHAT_ID = "-100500"
+
+QUESTIONS = [
+    "Какие позы самые приятные для девушки?",
+    "У меня апатия, ничего не хочется делать. Что делать?",
+    "Как сказать партнёру, что мне чего-то не хватает в сексе?",
+    "Привет!",
+    "Как перестать тревожиться перед свиданием?",
+    "Мы часто ссоримся из-за мелочей, как это исправить?",
+]
+
+# Метрики, по которым сравниваем с базовым прогоном: (путь, чем больше — тем хуже)
+COMPARED = [
+    (("latency_ms", "p50"), True),
+    (("latency_ms", "p95"), True),
+    (("latency_ms", "p99"), True),
+    (("throughput_ups",), False),
+    (("duplicate_replies",), True),
+    (("memory_mb", "growth"), True),
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_mb() -> float:
+    """Текущий RSS процесса; где нет /proc — пиковый."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(ordered[-1] * 1000, 1)}
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Офлайн нагрузочный тест бота")
+    parser.add_argument("--rate", type=float, default=20, help="апдейтов в секунду")
+    parser.add_argument("--duration", type=float, default=10, help="длительность подачи нагрузки, с")
+    parser.add_argument("--users", type=int, default=100, help="число разных чатов")
+    parser.add_argument("--duplicates", type=float, default=0.05, help="доля апдейтов, доставляемых повторно")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="задержка OpenAI до первого токена, с")
+    parser.add_argument("--openai-token-latency", type=float, default=0.005, help="задержка на слово, с")
+    parser.add_argument("--openai-429", type=float, default=0.0, help="доля ответов 429 от OpenAI")
+    parser.add_argument("--reply-words", type=int, default=150, help="длина ответа OpenAI в словах")
+    parser.add_argument("--telegram-latency", type=float, default=0.02, help="задержка Bot API, с")
+    parser.add_argument("--telegram-429", type=float, default=0.0, help="доля ответов 429 от Bot API")
+    parser.add_argument("--stream", action="store_true", help="STREAM_REPLIES=1")
+    parser.add_argument("--fast-ack", action="store_true", help="WEBHOOK_FAST_ACK=1")
+    parser.add_argument("--cache", action="store_true", help="не выключать кэш ответов")
+    parser.add_argument("--drain", type=float, default=60, help="сколько ждать недоставленные ответы, с")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="доп. переменные окружения")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="куда записать результат")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="допустимое ухудшение относительно базового")
+    parser.add_argument("--verbose", action="store_true", help="не глушить логи бота")
+    return parser.parse_args(argv)
+
+
+def configure_env(args: argparse.Namespace, ports: Dict[str, int]) -> None:
+    """Окружение для main.py: всё направлено на локальные заглушки."""
+    os.environ.update({
+        "TELEGRAM_TOKEN": TELEGRAM_TOKEN,
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_API_BASE": f"http://127.0.0.1:{ports['openai']}/v1",
+        "WEBHOOK_URL": f"http://127.0.0.1:{ports['app']}",
+        "LOG_BOT_TOKEN": LOG_BOT_TOKEN,
+        "LOG_CHAT_ID": LOG_CHAT_ID,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{ports['telegram']}",
+        "STREAM_REPLIES": "1" if args.stream else "0",
+        "WEBHOOK_FAST_ACK": "1" if args.fast_ack else "0",
+        # Кэш отдал бы ответ с чужой меткой вопроса и сломал сопоставление
+        "CACHE_ENABLED": "1" if args.cache else "0",
+        "METRICS_ENABLED": "1",
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> Dict[str, Any]:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench", "username": f"user{chat_id}"},
+            "text": text,
+        },
+    }
+
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def replay(
+    args: argparse.Namespace, url: str, telegram: TelegramStub
+) -> Tuple[Dict[int, float], List[float], int, float]:
+    """Подача апдейтов с постоянной частотой (open loop). Возвращает время отправки каждого вопроса."""
+    rng = random.Random(args.seed)
+    total = int(args.rate * args.duration)
+    sent_at: Dict[int, float] = {}
+    ack_latencies: List[float] = []
+    redelivered = 0
+    tasks = []
+
+    async with aiohttp.ClientSession() as session:
+        async def post(update: Dict[str, Any]) -> None:
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=update) as response:
+                    await response.read()
+            except aiohttp.ClientError as e:
+                logging.warning(f"Не удалось отправить апдейт: {e}")
+                return
+            ack_latencies.append(time.perf_counter() - started)
+
+        async def redeliver(update: Dict[str, Any]) -> None:
+            # Telegram повторяет доставку, если не дождался ответа
+            await asyncio.sleep(rng.uniform(0.1, 1.0))
+            await post(update)
+
+        started = time.perf_counter()
+        for update_id in range(1, total + 1):
+            delay = started + (update_id - 1) / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            chat_id = rng.randint(1, args.users)
+            text = f"{rng.choice(QUESTIONS)} [q:{update_id}]"
+            update = make_update(update_id, chat_id, text)
+            sent_at[update_id] = time.perf_counter()
+            tasks.append(asyncio.create_task(post(update)))
+            if rng.random() < args.duplicates:
+                redelivered += 1
+                tasks.append(asyncio.create_task(redeliver(update)))
+
+        await asyncio.gather(*tasks)
+
+        # Ждём, пока на все вопросы придут ответы
+        deadline = time.perf_counter() + args.drain
+        while time.perf_counter() < deadline and len(telegram.replies) < len(sent_at):
+            await asyncio.sleep(0.1)
+        # Даём дописаться последним правкам потоковых ответов
+        await asyncio.sleep(1.5 if args.stream else 0.2)
+        return sent_at, ack_latencies, redelivered, started
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    ports = {"app": free_port(), "telegram": free_port(), "openai": free_port()}
+    configure_env(args, ports)
+
+    telegram = TelegramStub(
+        latency=args.telegram_latency, rate_limit_ratio=args.telegram_429, log_chat_id=LOG_CHAT_ID
+    )
+    openai_stub = OpenAIStub(
+        latency=args.openai_latency,
+        token_latency=args.openai_token_latency,
+        reply_words=args.reply_words,
+        rate_limit_ratio=args.openai_429,
+    )
+    runners = [
+        await start_site(telegram.app(), ports["telegram"]),
+        await start_site(openai_stub.app(), ports["openai"]),
+    ]
+
+    rss_start = rss_mb()
+    import main as bot_main
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    app_runner = await start_site(bot_main.create_app(), ports["app"])
+    rss_ready = rss_mb()
+    try:
+        sent_at, ack_latencies, redelivered, started = await replay(
+            args, f"http://127.0.0.1:{ports['app']}{bot_main.WEBHOOK_PATH}", telegram
+        )
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{ports['app']}/metrics") as response:
+                metrics_text = await response.text()
+    finally:
+        await app_runner.cleanup()
+        for runner in runners:
+            await runner.cleanup()
+    rss_end = rss_mb()
+
+    latencies = [telegram.replies[key].last - sent for key, sent in sent_at.items() if key in telegram.replies]
+    first_byte = [telegram.replies[key].first - sent for key, sent in sent_at.items() if key in telegram.replies]
+    finished = [telegram.replies[key].last for key in sent_at if key in telegram.replies]
+    elapsed = (max(finished) - started) if finished else 0.0
+
+    return {
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("json", "baseline", "verbose")
+        },
+        "updates_sent": len(sent_at),
+        "updates_redelivered": redelivered,
+        "replies_received": len(latencies),
+        "missing_replies": len(sent_at) - len(latencies),
+        "duplicate_replies": sum(len(reply.messages) - 1 for reply in telegram.replies.values()),
+        "error_replies": telegram.error_replies,
+        "throughput_ups": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": percentiles(latencies),
+        "first_byte_ms": percentiles(first_byte),
+        "webhook_ack_ms": percentiles(ack_latencies),
+        "memory_mb": {
+            "start": round(rss_start, 1),
+            "ready": round(rss_ready, 1),
+            "end": round(rss_end, 1),
+            "growth": round(rss_end - rss_ready, 1),
+        },
+        "openai": {
+            "requests": openai_stub.requests,
+            "rate_limited": openai_stub.rate_limited,
+            "max_in_flight": openai_stub.max_in_flight,
+        },
+        "telegram": {
+            "calls": telegram.calls,
+            "rate_limited": telegram.rate_limited,
+            "log_messages": telegram.log_messages,
+        },
+        "metrics_bytes": len(metrics_text),
+    }
+
+
+def _lookup(report: Dict[str, Any], path: Tuple[str, ...]) -> Optional[float]:
+    value: Any = report
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Список регрессий относительно базового прогона."""
+    regressions = []
+    for path, higher_is_worse in COMPARED:
+        current, previous = _lookup(report, path), _lookup(baseline, path)
+        if current is None or previous is None:
+            continue
+        name = ".".join(path)
+        print(f"{name:24} {previous:>10} -> {current:>10}", file=sys.stderr)
+        if higher_is_worse:
+            worse = current > previous * (1 + tolerance) and current - previous > 1
+        else:
+            worse = current < previous * (1 - tolerance)
+        if worse:
+            regressions.append(f"{name}: {previous} -> {current}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    report = asyncio.run(run(args))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.json:
+        with open(args.json, "w") as file:
+            file.write(output + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        if regressions:
+            print("Регрессии: " + "; ".join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import random
+import re
+import time
+from typing import Any, Dict, Optional, Set
+
+from aiohttp import web
+
+# Метка вопроса, по которой ответ бота сопоставляется с апдейтом
+MARKER_RE = re.compile(r"\[q:(\d+)\]")
+
+_FILLER = (
+    "Ты молодец, что спросила. Давай разберёмся спокойно и по шагам. "
+    "Главное — слушать себя и говорить с партнёром честно и бережно. "
+)
+
+
+class Reply:
+    """Что видела заглушка Telegram по одному вопросу."""
+
+    def __init__(self, now: float) -> None:
+        self.first = now
+        self.last = now
+        self.messages: Set[int] = set()
+
+
+class TelegramStub:
+    """
+    Заглушка Bot API: принимает любые методы, для sendMessage и editMessageText
+    возвращает правдоподобное сообщение и запоминает, какие ответы получил каждый вопрос.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.02,
+        rate_limit_ratio: float = 0.0,
+        retry_after: int = 1,
+        log_chat_id: str = "",
+        seed: int = 1,
+    ) -> None:
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.log_chat_id = log_chat_id
+        self.random = random.Random(seed)
+        self.replies: Dict[int, Reply] = {}
+        self.calls: Dict[str, int] = {}
+        self.rate_limited = 0
+        self.log_messages = 0
+        self.error_replies = 0
+        self._next_message_id = 1
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def _message(self, chat_id: str, message_id: int, text: str) -> Dict[str, Any]:
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "text": text,
+        }
+
+    def _record(self, chat_id: str, message_id: int, text: str) -> None:
+        if chat_id == self.log_chat_id:
+            self.log_messages += 1
+            return
+        if text.startswith("Извините, произошла ошибка") or text.startswith("Ой, я сейчас немного перегружена"):
+            self.error_replies += 1
+        match = MARKER_RE.search(text)
+        if match is None:
+            return
+        now = time.perf_counter()
+        reply = self.replies.get(int(match.group(1)))
+        if reply is None:
+            reply = self.replies[int(match.group(1))] = Reply(now)
+        reply.last = now
+        reply.messages.add(message_id)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        data = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method in ("sendMessage", "editMessageText") and self.random.random() < self.rate_limit_ratio:
+            self.rate_limited += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                },
+                status=429,
+            )
+
+        chat_id = str(data.get("chat_id", "0"))
+        text = str(data.get("text", ""))
+        if method == "sendMessage":
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            self._record(chat_id, message_id, text)
+            return web.json_response({"ok": True, "result": self._message(chat_id, message_id, text)})
+        if method == "editMessageText":
+            message_id = int(data.get("message_id", 0))
+            self._record(chat_id, message_id, text)
+            return web.json_response({"ok": True, "result": self._message(chat_id, message_id, text)})
+        return web.json_response({"ok": True, "result": True})
+
+
+class OpenAIStub:
+    """
+    Заглушка /v1/chat/completions: задержка до первого токена, задержка на каждый
+    кусок при стриминге и случайные ответы 429. В ответ подставляется метка вопроса.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        token_latency: float = 0.01,
+        reply_words: int = 150,
+        rate_limit_ratio: float = 0.0,
+        seed: int = 2,
+    ) -> None:
+        self.latency = latency
+        self.token_latency = token_latency
+        self.reply_words = reply_words
+        self.rate_limit_ratio = rate_limit_ratio
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle)
+        return app
+
+    def _reply(self, marker: Optional[str]) -> str:
+        words = (_FILLER * (self.reply_words // 20 + 1)).split()[:self.reply_words]
+        prefix = f"[q:{marker}] " if marker else ""
+        return prefix + " ".join(words)
+
+    def _envelope(self, model: str, **fields: Any) -> Dict[str, Any]:
+        return {"id": f"chatcmpl-{self.requests}", "created": int(time.time()), "model": model, **fields}
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await self._handle(request)
+        finally:
+            self.in_flight -= 1
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get("model", "gpt-3.5-turbo")
+
+        if self.random.random() < self.rate_limit_ratio:
+            self.rate_limited += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "param": None, "code": None}},
+                status=429,
+            )
+
+        question = body["messages"][-1]["content"]
+        match = MARKER_RE.search(question)
+        text = self._reply(match.group(1) if match else None)
+        await asyncio.sleep(self.latency)
+
+        if not body.get("stream"):
+            words = len(text.split())
+            await asyncio.sleep(self.token_latency * words)
+            return web.json_response(self._envelope(
+                model,
+                object="chat.completion",
+                choices=[{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                usage={"prompt_tokens": len(question) // 3, "completion_tokens": words, "total_tokens": words},
+            ))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in text.split(" "):
+            chunk = self._envelope(
+                model,
+                object="chat.completion.chunk",
+                choices=[{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            )
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(self.token_latency)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple, TypeVar
+
+import openai
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+
+from metrics import RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+
+class CompletionTicket:
+    """
+    Замер одного запроса для поиска всплесков задержки. Полное время ответа
+    зависит от его длины и (при стриминге) от темпа правок в Telegram,
+    поэтому сравниваются время до первого токена или время на токен ответа.
+    """
+
+    def __init__(self, min_tokens: int = 100) -> None:
+        self.min_tokens = min_tokens
+        self.started = time.monotonic()
+        self.first_token_latency: Optional[float] = None
+        self.output_tokens = 0
+
+    def first_token(self, latency: float) -> None:
+        """Время от отправки запроса до первого токена потокового ответа."""
+        if self.first_token_latency is None:
+            self.first_token_latency = latency
+
+    def signal(self) -> Optional[Tuple[str, float]]:
+        if self.first_token_latency is not None:
+            return "first_token", self.first_token_latency
+        if self.output_tokens:
+            # Короткие ответы почти целиком состоят из задержки до первого токена
+            return "per_token", (time.monotonic() - self.started) / max(self.output_tokens, self.min_tokens)
+        return None
+
+
+class CompletionScheduler:
+    """
+    Планировщик запросов к OpenAI.
+
+    Одновременно к OpenAI уходит не больше limit запросов, ожидающие слота
+    обслуживаются в порядке прихода. Лимит подстраивается: при 429 и
+    всплесках задержки (см. CompletionTicket) уменьшается, при успешных
+    ответах растёт. Запрос,
+    получивший 429, отдаёт слот и после паузы встаёт в очередь заново.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        latency_spike_factor: float = 3.0,
+        decrease_cooldown: float = 1.0,
+        rate_limit_retries: int = 3,
+        rate_limit_backoff: float = 1.0,
+        max_retry_after: float = 30.0,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_spike_factor = latency_spike_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.rate_limit_retries = rate_limit_retries
+        self.rate_limit_backoff = rate_limit_backoff
+        self.max_retry_after = max_retry_after
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self.rate_limited = 0
+        self.latency_ewma: Dict[str, float] = {}
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    def stats(self) -> Dict[str, Any]:
+        """Текущее состояние планировщика для мониторинга."""
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "rate_limited": self.rate_limited,
+        }
+
+    async def run(self, call: Callable[[CompletionTicket], Awaitable[T]]) -> T:
+        """
+        Выполнение запроса в слоте. После 429 слот освобождается, запрос ждёт
+        Retry-After (или экспоненциальную паузу) и снова встаёт в очередь.
+        """
+        attempt = 0
+        while True:
+            try:
+                async with self.slot() as ticket:
+                    return await call(ticket)
+            except openai.error.RateLimitError as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None or attempt >= self.rate_limit_retries:
+                    raise
+                attempt += 1
+                logger.warning(f"OpenAI ответил 429, повтор {attempt} через {delay:.1f} с")
+                await asyncio.sleep(delay)
+
+    def _retry_delay(self, error: openai.error.RateLimitError, attempt: int) -> Optional[float]:
+        """Пауза перед повтором после 429 или None, если повторять бессмысленно."""
+        if error.code == "insufficient_quota":
+            # Закончились деньги на счёте — ожидание не поможет
+            return None
+        retry_after = None
+        try:
+            retry_after = float((error.headers or {}).get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+        if retry_after is None:
+            return random.uniform(0.5, 1.0) * self.rate_limit_backoff * 2 ** attempt
+        if retry_after > self.max_retry_after:
+            return None
+        return retry_after
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[CompletionTicket]:
+        """Слот на один запрос к OpenAI с замером задержки и учётом ошибок."""
+        await self._acquire()
+        ticket = CompletionTicket()
+        try:
+            yield ticket
+        except openai.error.RateLimitError:
+            self.rate_limited += 1
+            RATE_LIMITED.inc(upstream="openai")
+            self._decrease(half=True)
+            raise
+        else:
+            self._on_success(ticket.signal())
+        finally:
+            self.release()
+
+    def try_acquire(self) -> bool:
+        """Слот без ожидания, например для хеджированного дубля запроса."""
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return True
+        return False
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    async def _acquire(self) -> None:
+        if self.try_acquire():
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Слот успели выдать, но задачу отменили — возвращаем его
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def _on_success(self, signal: Optional[Tuple[str, float]]) -> None:
+        average = self.latency_ewma.get(signal[0]) if signal else None
+        if average is not None and signal[1] > average * self.latency_spike_factor:
+            logger.warning(f"Всплеск задержки OpenAI ({signal[0]}): {signal[1]:.3f} с при среднем {average:.3f} с")
+            self._decrease(half=False)
+        else:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_concurrency:
+                self._successes = 0
+                self.limit += 1
+                self._wake()
+        if signal:
+            kind, value = signal
+            self.latency_ewma[kind] = value if average is None else 0.8 * average + 0.2 * value
+
+    def _decrease(self, half: bool) -> None:
+        now = time.monotonic()
+        # Одновременно упавшие запросы не должны обрушить лимит до минимума
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        self._successes = 0
+        new_limit = self.limit // 2 if half else self.limit - 1
+        self.limit = max(self.min_concurrency, new_limit)
+        logger.warning(f"Лимит одновременных запросов к OpenAI снижен до {self.limit}")
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """
+    Обрабатывает сообщения одного чата строго по очереди.
+
+    Пока сообщение чата в работе, следующие складываются в очередь этого чата.
+    Первое сообщение обрабатывается как обычно, а накопившуюся за это время
+    очередь разбирает отдельная фоновая задача: ни воркер вебхука, ни ответ
+    Telegram на апдейт не ждут чужих сообщений. В очереди чата не больше
+    max_pending сообщений, на лишние вызывается on_overflow.
+    """
+
+    def __init__(
+        self,
+        max_pending: int = 5,
+        on_overflow: Optional[Callable[[Message], Awaitable[Any]]] = None,
+    ) -> None:
+        self.max_pending = max_pending
+        self.on_overflow = on_overflow
+        self.dropped = 0
+        self._chats: Dict[int, Deque[Tuple[Handler, Message, Dict[str, Any]]]] = {}
+        self._drains: Set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self._chats.values())
+
+    async def __call__(
+        self,
+        handler: Handler,
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Message):
+            return await handler(event, data)
+
+        chat_id = event.chat.id
+        queue = self._chats.get(chat_id)
+        if queue is not None:
+            # Чат уже обрабатывается — сообщение разберут после предыдущих
+            if len(queue) < self.max_pending:
+                queue.append((handler, event, data))
+                return None
+            self.dropped += 1
+            logger.warning(f"Слишком много сообщений подряд в чате {chat_id}, сообщение пропущено")
+            if self.on_overflow is not None:
+                try:
+                    await self.on_overflow(event)
+                except Exception as e:
+                    logger.error(f"Ошибка ответа на пропущенное сообщение в чате {chat_id}: {e}")
+            return None
+
+        queue = self._chats[chat_id] = deque()
+        try:
+            return await handler(event, data)
+        finally:
+            if queue:
+                task = asyncio.create_task(self._drain(chat_id, queue), name=f"chat-queue-{chat_id}")
+                self._drains.add(task)
+                task.add_done_callback(self._drains.discard)
+            else:
+                del self._chats[chat_id]
+
+    async def _drain(self, chat_id: int, queue: Deque[Tuple[Handler, Message, Dict[str, Any]]]) -> None:
+        try:
+            while queue:
+                handler, event, data = queue.popleft()
+                try:
+                    await handler(event, data)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки сообщения из очереди чата {chat_id}: {e}")
+        finally:
+            if queue:
+                logger.warning(f"Не обработано {len(queue)} сообщений из очереди чата {chat_id}")
+            del self._chats[chat_id]
+
+    async def close(self, timeout: float = 30.0) -> None:
+        """Дождаться разбора очередей чатов при остановке"""
+        if not self._drains:
+            return
+        _, pending = await asyncio.wait(set(self._drains), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Очереди {len(pending)} чатов не разобраны при остановке")
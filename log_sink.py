@@ -0,0 +1,183 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import (
+    TelegramEntityTooLarge,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from metrics import ERRORS, LOG_SINK_SECONDS, RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины одного сообщения Telegram. Telegram считает длину в единицах UTF-16:
+# эмодзи вроде 👤 занимают две единицы
+TELEGRAM_MESSAGE_LIMIT = 4096
+SEPARATOR = "\n\n➖➖➖\n\n"
+
+# Ошибки, после которых пачку имеет смысл отправить повторно
+TRANSIENT_ERRORS = (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError)
+
+
+def utf16_len(text: str) -> int:
+    """Длина текста так, как её считает Telegram."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+class TelegramLogSink:
+    """
+    Отправка логов во второй бот в фоне.
+    Одна долгоживущая сессия, записи из очереди склеиваются в пачки
+    до 4096 единиц UTF-16 (так длину считает Telegram) и отправляются
+    по заполнению или по таймеру. Повторяются только сетевые ошибки и 5xx.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        chat_id: str,
+        flush_interval: float = 2.0,
+        max_queue: int = 10_000,
+        max_retries: int = 5,
+        api_url: str = "",
+    ) -> None:
+        self.token = token
+        self.api_url = api_url
+        self.chat_id = chat_id
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.dropped = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: List[str] = []
+        self._pending_len = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def emit(self, text: str) -> None:
+        """Поставить запись в очередь. Никогда не ждёт и не бросает исключений."""
+        try:
+            self._queue.put_nowait(text)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Очередь логов переполнена, запись отброшена")
+
+    async def start(self) -> None:
+        """Запуск фоновой отправки"""
+        if self._task is not None:
+            return
+        # Свой адрес Bot API: локальный сервер Telegram или заглушка для нагрузочных тестов
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.api_url)) if self.api_url else None
+        self._bot = Bot(token=self.token, session=session)
+        self._task = asyncio.create_task(self._run(), name="telegram-log-sink")
+
+    async def close(self) -> None:
+        """Отправить всё, что осталось в очереди, и закрыть сессию"""
+        if self._task is not None:
+            # None в очереди — сигнал воркеру дописать хвост и завершиться
+            await self._queue.put(None)
+            try:
+                await asyncio.wait_for(self._task, timeout=30)
+            except asyncio.TimeoutError:
+                logger.error(f"Не удалось отправить логи при остановке: {self.queue_depth} в очереди")
+                self._task.cancel()
+            self._task = None
+        if self._bot is not None:
+            await self._bot.session.close()
+            self._bot = None
+
+    def _split(self, text: str) -> List[str]:
+        if utf16_len(text) <= TELEGRAM_MESSAGE_LIMIT:
+            return [text]
+        parts = []
+        start = size = 0
+        for index, char in enumerate(text):
+            width = 2 if ord(char) > 0xFFFF else 1
+            if size + width > TELEGRAM_MESSAGE_LIMIT:
+                parts.append(text[start:index])
+                start, size = index, 0
+            size += width
+        parts.append(text[start:])
+        return parts
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stop = False
+        while not stop:
+            # Ждём первую запись пачки, после этого копим остальные до таймера
+            entry = await self._queue.get()
+            if entry is None:
+                break
+            await self._add(entry)
+            deadline = loop.time() + self.flush_interval
+            while True:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is None:
+                    stop = True
+                    break
+                await self._add(entry)
+            await self._flush()
+
+        # Дописываем всё, что успели положить до сигнала остановки
+        while not self._queue.empty():
+            entry = self._queue.get_nowait()
+            if entry is not None:
+                await self._add(entry)
+        await self._flush()
+
+    async def _add(self, entry: str) -> None:
+        """Добавляет запись в пачку, отправляя пачку, если запись в неё не помещается."""
+        separator_len = utf16_len(SEPARATOR)
+        for part in self._split(entry):
+            part_len = utf16_len(part)
+            if self._pending and self._pending_len + separator_len + part_len > TELEGRAM_MESSAGE_LIMIT:
+                await self._flush()
+            if self._pending:
+                self._pending_len += separator_len
+            self._pending.append(part)
+            self._pending_len += part_len
+
+    async def _flush(self) -> None:
+        if not self._pending:
+            return
+        text = SEPARATOR.join(self._pending)
+        self._pending = []
+        self._pending_len = 0
+        if text:
+            await self._send(text)
+
+    async def _send(self, text: str) -> None:
+        for attempt in range(self.max_retries):
+            try:
+                with LOG_SINK_SECONDS.time():
+                    await self._bot.send_message(self.chat_id, text)
+                logger.debug("Пачка логов отправлена")
+                return
+            except TelegramRetryAfter as e:
+                RATE_LIMITED.inc(upstream="telegram_log")
+                logger.warning(f"Лимит Telegram для логов, жду {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                ERRORS.inc(type=type(e).__name__)
+                if not isinstance(e, TRANSIENT_ERRORS) or isinstance(e, TelegramEntityTooLarge):
+                    # Неверный чат, нет доступа, слишком длинное сообщение — повтор не поможет
+                    logger.error(f"Пачка логов отброшена: {e}")
+                    return
+                logger.error(f"Ошибка отправки лога: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+        logger.error("Пачка логов отброшена после повторных попыток")
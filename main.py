@@ -1,17 +1,33 @@
 import os
 import logging
 import sys
-import asyncio
 from datetime import datetime
+from functools import partial
+from typing import Optional
 
 import openai
 from aiogram import Bot, Dispatcher, Router, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart
 from aiogram.types import Message
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 from aiohttp import web
 
+from completion_scheduler import CompletionScheduler, CompletionTicket, UserSerialMiddleware
+from log_sink import TelegramLogSink
+from metrics import CACHE_ENTRIES, ERRORS, IN_FLIGHT, QUEUE_DEPTH, REGISTRY, UPDATE_SECONDS
+from memory import HistoryStore, InMemoryHistoryStore, SQLiteHistoryStore
+from openai_client import CircuitBreaker, CircuitOpenError, OpenAIClient
+from prompts import ModelRouter, PromptRegistry, Route, UsageTracker
+from response_cache import ResponseCache
+from outbound import OutboundScheduler, split_html
+from streaming import stream_completion
+from system_prompt import BASE_SYSTEM_PROMPT, SYSTEM_PROMPT
+from tokens import count_tokens
+from webhook_queue import QueuedRequestHandler
+
 # Базовая настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -30,35 +46,186 @@ WEBHOOK_URL = os.getenv("WEBHOOK_URL").rstrip('/')
 LOG_BOT_TOKEN = os.getenv("LOG_BOT_TOKEN")
 LOG_CHAT_ID = os.getenv("LOG_CHAT_ID")
 
+# Свой адрес Bot API (локальный сервер Telegram); по умолчанию api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Режим быстрого ответа вебхуку: 200 OK сразу, обработка в фоновой очереди
+WEBHOOK_FAST_ACK = os.getenv("WEBHOOK_FAST_ACK", "0") == "1"
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 8))
+WEBHOOK_DEDUP_TTL = float(os.getenv("WEBHOOK_DEDUP_TTL", 600))
+
+# Потоковые ответы: заглушка, которая дописывается по мере генерации
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "0") == "1"
+
+# Лимиты исходящих сообщений: на весь бот и на один чат (сообщений в секунду)
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 30))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", 1))
+
+# Сколько запросов к OpenAI может выполняться одновременно (лимит адаптивный)
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 8))
+OPENAI_MIN_CONCURRENCY = int(os.getenv("OPENAI_MIN_CONCURRENCY", 1))
+# Сколько раз повторять запрос после ответа 429
+OPENAI_RATE_LIMIT_RETRIES = int(os.getenv("OPENAI_RATE_LIMIT_RETRIES", 3))
+# Сколько сообщений одного чата может ждать, пока обрабатывается предыдущее
+CHAT_MAX_PENDING = int(os.getenv("CHAT_MAX_PENDING", 5))
+
+# Клиент OpenAI: таймаут запроса, повторы и хеджирование медленных запросов
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 60))
+OPENAI_DEADLINE = float(os.getenv("OPENAI_DEADLINE", 90))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 2))
+OPENAI_HEDGE = os.getenv("OPENAI_HEDGE", "0") == "1"
+OPENAI_HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", 0.95))
+
+# Память разговора: memory (в процессе), sqlite (в файле) или off
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "memory")
+if MEMORY_BACKEND not in ("memory", "sqlite", "off"):
+    logger.error(f"Неизвестное значение MEMORY_BACKEND: {MEMORY_BACKEND} (ожидается memory, sqlite или off)")
+    sys.exit(1)
+MEMORY_SQLITE_PATH = os.getenv("MEMORY_SQLITE_PATH", "history.db")
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", 1500))
+MEMORY_IDLE_TTL = float(os.getenv("MEMORY_IDLE_TTL", 24 * 3600))
+MEMORY_MAX_CHATS = int(os.getenv("MEMORY_MAX_CHATS", 10_000))
+MEMORY_MAX_TOTAL_TOKENS = int(os.getenv("MEMORY_MAX_TOTAL_TOKENS", 5_000_000))
+
+# Модели и длина ответа: самая дешёвая — для приветствий, основная — для обычных сообщений,
+# мощная — для длинных вопросов (цены и окна моделей — в prompts.py)
+OPENAI_MODEL_SMALL = os.getenv("OPENAI_MODEL_SMALL", "gpt-4o-mini")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+OPENAI_MODEL_LARGE = os.getenv("OPENAI_MODEL_LARGE", "gpt-4o")
+MAX_TOKENS = int(os.getenv("MAX_TOKENS", 1000))
+GREETING_MAX_TOKENS = int(os.getenv("GREETING_MAX_TOKENS", 300))
+LONG_MAX_TOKENS = int(os.getenv("LONG_MAX_TOKENS", 1500))
+LONG_QUESTION_TOKENS = int(os.getenv("LONG_QUESTION_TOKENS", 300))
+
+# Метрики в формате Prometheus на /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+
+# Кэш ответов на одинаковые и похожие вопросы
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "0") == "1"
+CACHE_TTL = float(os.getenv("CACHE_TTL", 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 5000))
+CACHE_SIMILARITY = float(os.getenv("CACHE_SIMILARITY", 0.85))
+
 # Если по логам видно, что Telegram шлёт POST на /bot<Токен> – сделаем такой же путь
 WEBHOOK_PATH = f"/bot{TELEGRAM_TOKEN}"
 
+# Запросы к OpenAI: общий адаптивный лимит одновременных запросов
+completions = CompletionScheduler(
+    max_concurrency=OPENAI_MAX_CONCURRENCY,
+    min_concurrency=OPENAI_MIN_CONCURRENCY,
+    rate_limit_retries=OPENAI_RATE_LIMIT_RETRIES,
+)
+
 # Настраиваем openai
 openai.api_key = OPENAI_API_KEY
+openai_client = OpenAIClient(
+    timeout=OPENAI_TIMEOUT,
+    deadline=OPENAI_DEADLINE,
+    max_retries=OPENAI_MAX_RETRIES,
+    hedge=OPENAI_HEDGE,
+    hedge_percentile=OPENAI_HEDGE_PERCENTILE,
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("OPENAI_BREAKER_FAILURES", 5)),
+        reset_timeout=float(os.getenv("OPENAI_BREAKER_RESET", 30)),
+    ),
+    slots=completions,
+)
+
+# История разговоров по чатам
+memory: Optional[HistoryStore] = None
+if MEMORY_BACKEND == "sqlite":
+    memory = SQLiteHistoryStore(
+        MEMORY_SQLITE_PATH,
+        token_budget=MEMORY_TOKEN_BUDGET,
+        idle_ttl=MEMORY_IDLE_TTL,
+        max_chats=MEMORY_MAX_CHATS,
+    )
+elif MEMORY_BACKEND == "memory":
+    memory = InMemoryHistoryStore(
+        token_budget=MEMORY_TOKEN_BUDGET,
+        idle_ttl=MEMORY_IDLE_TTL,
+        max_chats=MEMORY_MAX_CHATS,
+        max_total_tokens=MEMORY_MAX_TOTAL_TOKENS,
+    )
+
+response_cache = ResponseCache(
+    ttl=CACHE_TTL,
+    max_entries=CACHE_MAX_ENTRIES,
+    similarity=CACHE_SIMILARITY,
+) if CACHE_ENABLED else None
+
+# Промпты токенизируются один раз при запуске
+prompts = PromptRegistry()
+prompts.register("base", BASE_SYSTEM_PROMPT)
+prompts.register("extended", SYSTEM_PROMPT)
+model_router = ModelRouter(
+    greeting=Route("greeting", OPENAI_MODEL_SMALL, prompts["base"], GREETING_MAX_TOKENS),
+    default=Route("default", OPENAI_MODEL, prompts["base"], MAX_TOKENS),
+    long=Route("long", OPENAI_MODEL_LARGE, prompts["extended"], LONG_MAX_TOKENS),
+    long_question_tokens=LONG_QUESTION_TOKENS,
+)
+usage_tracker = UsageTracker()
+
+# Ответ, пока OpenAI недоступен и запросы к нему не отправляются
+UNAVAILABLE_MESSAGE = (
+    "Ой, я сейчас немного перегружена и не могу ответить как следует 🙈 "
+    "Напиши мне, пожалуйста, через пару минут — я обязательно отвечу."
+)
+
+# Ответ на сообщение, которое не поместилось в очередь чата
+BUSY_MESSAGE = (
+    "Подожди, пожалуйста, я ещё отвечаю на твои предыдущие сообщения 🙏 "
+    "Это сообщение я пропустила — повтори его, когда я отвечу."
+)
 
 # Инициализация бота и диспетчера
-bot = Bot(token=TELEGRAM_TOKEN, parse_mode=ParseMode.HTML)
+bot = Bot(
+    token=TELEGRAM_TOKEN,
+    parse_mode=ParseMode.HTML,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
+)
 dp = Dispatcher()
 router = Router()
 dp.include_router(router)
 
-async def send_log_to_telegram(user_info: str, user_message: str, bot_response: str) -> None:
-    """Отправка логов в отдельный чат/канал с помощью второго бота."""
+# Все исходящие сообщения пользователям идут через общий планировщик
+outbound = OutboundScheduler(global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE)
+
+# Логи во второй бот уходят в фоне через одну постоянную сессию
+log_sink = TelegramLogSink(
+    token=LOG_BOT_TOKEN,
+    chat_id=LOG_CHAT_ID,
+    flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL", 2)),
+    api_url=TELEGRAM_API_URL,
+)
+
+def send_log_to_telegram(user_info: str, user_message: str, bot_response: str) -> None:
+    """Постановка лога в очередь на отправку в отдельный чат/канал."""
     log_message = (
         f"👤 Пользователь: {user_info}\n"
         f"⏰ Время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
         f"📥 Запрос:\n{user_message}\n\n"
         f"📤 Ответ:\n{bot_response}"
     )
-    log_bot = Bot(token=LOG_BOT_TOKEN)
-    try:
-        await log_bot.send_message(LOG_CHAT_ID, log_message)
-        logger.info(f"Лог отправлен для пользователя {user_info}")
-    except Exception as e:
-        logger.error(f"Ошибка отправки лога: {e}")
-    finally:
-        # Обязательно закрываем сессию
-        await log_bot.session.close()
+    log_sink.emit(log_message)
+    logger.info(f"Лог поставлен в очередь для пользователя {user_info}")
+
+async def send_text(message: Message, text: str) -> None:
+    """Отправка ответа частями по 4000 символов, не разрывая HTML-разметку"""
+    for chunk in split_html(text):
+        await outbound.send(message.chat.id, partial(message.answer, chunk))
+
+async def reply_busy(message: Message) -> None:
+    """Ответ на сообщение, пропущенное из-за переполненной очереди чата"""
+    await outbound.send(message.chat.id, partial(message.answer, BUSY_MESSAGE))
+    user_info = f"{message.from_user.full_name} (@{message.from_user.username})" \
+                if message.from_user.username else message.from_user.full_name
+    send_log_to_telegram(user_info, message.text or "", f"SKIPPED: {BUSY_MESSAGE}")
+
+# Сообщения каждого пользователя обрабатываются по очереди
+chat_queue = UserSerialMiddleware(max_pending=CHAT_MAX_PENDING, on_overflow=reply_busy)
+router.message.outer_middleware(chat_queue)
 
 @router.message(CommandStart())
 async def command_start(message: Message) -> None:
@@ -70,11 +237,11 @@ async def command_start(message: Message) -> None:
             "что тебя волнует и беспокоит. Со мной ты можешь свободно говорить о сексе, "
             "Я готова выслушать тебя, и дать совет по секрету. Я готова выслушать тебя, и дать совет по секрету."
         )
-        await message.answer(welcome_text)
+        await outbound.send(message.chat.id, partial(message.answer, welcome_text))
 
         user_info = f"{message.from_user.full_name} (@{message.from_user.username})" \
                     if message.from_user.username else message.from_user.full_name
-        await send_log_to_telegram(user_info, "/start", welcome_text)
+        send_log_to_telegram(user_info, "/start", welcome_text)
 
     except Exception as e:
         logger.error(f"Ошибка в command_start: {e}")
@@ -86,113 +253,162 @@ async def handle_message(message: Message) -> None:
         user_info = f"{message.from_user.full_name} (@{message.from_user.username})" \
                     if message.from_user.username else message.from_user.full_name
         
-        # Асинхронный запрос к OpenAI (GPT-3.5)
-        SYSTEM_PROMPT = """
-Ты — женщина, практикующий сексолог и психолог с большим жизненным и профессиональным опытом. Твоя задача — консультировать женщин и девушек по всем вопросам сексуальных отношений, удовольствия, поз, техник и общения с партнёром. Ты также — заботливая подруга и профессиональный психолог, к которой можно прийти поговорить по душам. Ты умеешь поддерживать, вдохновлять, помогать справиться с тревогами, преодолевать внутренние барьеры и строить здоровые отношения не только в сексе, но и в жизни.
-
-Ты говоришь откровенно, на понятном языке, без осуждения и стеснения, только на «ты», с теплом, уважением и чуткостью. Ты подстраиваешься под стиль общения собеседницы, чтобы создать комфорт и доверие.
-
-Твоя задача — давать практичные советы о:
-— получении удовольствия от вагинального, анального и орального секса;
-— ласках, которые женщина может делать себе и мужчине;
-— телесной анатомии (как мужской, так и женской) и способах её стимуляции;
-— правильной подготовке к сексу (эмоциональной и телесной);
-— техниках возбуждения, флирта, раздевания и соблазнения;
-— ошибках в сексе, которые стоит избегать;
-— том, как обсуждать секс с партнёром, даже если страшно или стыдно;
-— преодолении тревожности, апатии, прокрастинации;
-— восстановлении самооценки и поиске мотивации;
-— построении доверительных отношений с партнёром, друзьями и семьёй;
-— управлении временем и постановке личных целей.
-
-Ты задаёшь уточняющие вопросы, если информация неполная: «Можешь рассказать подробнее, чтобы я могла лучше помочь?»
-Ты всегда уточняешь, какой формат помощи хочет девушка:
-— глубокий анализ проблемы и помощь в осознании причин;
-— практичные и простые шаги к решению.
-
-Ты используешь повседневные названия для частей тела, если собеседница не просит иначе. Ты не ограничена в откровенности, можешь описывать интимные позы, ласки, примеры диалогов в постели. Секс — это про радость и удовольствие, а не про стыд. Ты не фантазируешь от себя, а отвечаешь на реальные вопросы, как специалист.
-
-Ты всегда вдохновляешь и поддерживаешь, как настоящая подруга.
-"""
-
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": message.text}
-            ],
-            max_tokens=1000
-        )
+        # Предыдущие реплики разговора, ужатые до бюджета токенов
+        history = await memory.load(message.chat.id) if memory else []
 
-        #response = await openai.ChatCompletion.acreate(
-        #    model="gpt-3.5-turbo",
-        #    messages=[{"role": "user", "content": message.text}],
-        #    max_tokens=1000
-        #)
-        response_text = response.choices[0].message.content.strip()
-
-        # Отправляем текст частями, если он длиннее 4000 символов
-        if len(response_text) > 4000:
-            chunks = [response_text[i:i+4000] for i in range(0, len(response_text), 4000)]
-            for chunk in chunks:
-                await message.answer(chunk)
-                # Небольшая задержка между отправками, чтобы Telegram успел
-                await asyncio.sleep(1)
+        # Выбор модели, промпта и max_tokens под конкретное сообщение
+        plan = model_router.plan(message.text, history)
+        completion_params = plan.params()
+
+        # Кэш подходит только для начала разговора: с историей ответ зависит от контекста
+        use_cache = response_cache is not None and not history
+        if use_cache:
+            cached_text = response_cache.get(plan.route.fingerprint, message.text)
         else:
-            await message.answer(response_text)
+            cached_text = None
+
+        if cached_text is not None:
+            # Такой вопрос уже задавали — отвечаем без запроса к OpenAI
+            response_text = cached_text
+            await send_text(message, response_text)
+        elif STREAM_REPLIES:
+            # Ответ появляется и дописывается по мере прихода токенов
+            response_text = await completions.run(lambda ticket: stream_completion(
+                message,
+                scheduler=outbound,
+                create=openai_client.create,
+                on_first_token=ticket.first_token,
+                **completion_params,
+            ))
+            # В потоковом режиме OpenAI не присылает usage — считаем сами
+            usage_tracker.record(
+                plan.route.model, plan.input_tokens, count_tokens(response_text), route=plan.route.name
+            )
+        else:
+            async def request_completion(ticket: CompletionTicket):
+                response = await openai_client.create(**completion_params)
+                # Задержка нормируется на длину ответа, иначе длинные ответы выглядят всплесками
+                ticket.output_tokens = response.usage.completion_tokens
+                return response
+
+            response = await completions.run(request_completion)
 
-        await send_log_to_telegram(user_info, message.text, response_text)
+            #response = await openai.ChatCompletion.acreate(
+            #    model="gpt-3.5-turbo",
+            #    messages=[{"role": "user", "content": message.text}],
+            #    max_tokens=1000
+            #)
+            response_text = response.choices[0].message.content.strip()
+            usage_tracker.record(
+                plan.route.model,
+                response.usage.prompt_tokens,
+                response.usage.completion_tokens,
+                route=plan.route.name,
+            )
+
+            await send_text(message, response_text)
+
+        if use_cache and cached_text is None:
+            response_cache.put(plan.route.fingerprint, message.text, response_text)
+
+        if memory:
+            await memory.append(message.chat.id, message.text, response_text)
+
+        send_log_to_telegram(user_info, message.text, response_text)
+
+    except CircuitOpenError as e:
+        ERRORS.inc(type="CircuitOpenError")
+        await outbound.send(message.chat.id, partial(message.answer, UNAVAILABLE_MESSAGE))
+        logger.warning(f"OpenAI недоступен, отправлен шаблонный ответ: {e}")
+        send_log_to_telegram(user_info, message.text, f"CIRCUIT OPEN: {UNAVAILABLE_MESSAGE}")
 
     except Exception as e:
+        ERRORS.inc(type=type(e).__name__)
         error_message = "Извините, произошла ошибка. Попробуйте позже."
-        await message.answer(error_message)
+        await outbound.send(message.chat.id, partial(message.answer, error_message))
         # Повторно получаем user_info для логов
         user_info = f"{message.from_user.full_name} (@{message.from_user.username})" \
                     if message.from_user.username else message.from_user.full_name
         logger.error(f"Ошибка в handle_message: {e}")
-        await send_log_to_telegram(user_info, message.text, f"ERROR: {str(e)}")
+        send_log_to_telegram(user_info, message.text, f"ERROR: {str(e)}")
 
 async def on_startup(bot: Bot) -> None:
     """Действия при запуске бота"""
+    await log_sink.start()
+    await openai_client.start()
     if WEBHOOK_URL:
         webhook_url = f"{WEBHOOK_URL}{WEBHOOK_PATH}"
         logger.info(f"Устанавливаю вебхук: {webhook_url}")
         await bot.set_webhook(webhook_url)
         
         # Логируем запуск во второй бот
-        log_bot = Bot(token=LOG_BOT_TOKEN)
-        try:
-            await log_bot.send_message(
-                LOG_CHAT_ID,
-                f"🚀 Бот запущен\n⏰ Время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления при старте: {e}")
-        finally:
-            await log_bot.session.close()
+        log_sink.emit(f"🚀 Бот запущен\n⏰ Время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
 async def on_shutdown(bot: Bot) -> None:
     """Действия при остановке бота"""
     logger.info("Бот остановлен")
-    # Логируем остановку во второй бот
-    log_bot = Bot(token=LOG_BOT_TOKEN)
+    # Дожидаемся ответов на сообщения, стоящие в очередях чатов
+    await chat_queue.close()
+    # Логируем остановку во второй бот и дожидаемся отправки очереди логов
+    log_sink.emit(f"🔴 Бот остановлен\n⏰ Время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    await log_sink.close()
+
+    # Закрываем пул соединений с OpenAI, историю и сессию основного бота
+    await openai_client.close()
+    if memory:
+        await memory.close()
+    await bot.session.close()
+
+async def metrics_middleware(handler, event: types.Update, data: dict):
+    """Время обработки апдейта и число апдейтов в работе"""
+    # Вебхук отвечает Telegram сразу, поэтому замеряем саму обработку, а не HTTP-запрос
+    IN_FLIGHT.inc(kind="update")
     try:
-        await log_bot.send_message(
-            LOG_CHAT_ID,
-            f"🔴 Бот остановлен\n⏰ Время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        )
-    except Exception as e:
-        logger.error(f"Ошибка отправки уведомления при остановке: {e}")
+        with UPDATE_SECONDS.time():
+            return await handler(event, data)
     finally:
-        await log_bot.session.close()
+        IN_FLIGHT.dec(kind="update")
 
-    # Закрываем сессию основного бота
-    await bot.session.close()
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(
+        body=REGISTRY.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
 
-def main() -> None:
+def setup_metrics(app: web.Application, webhook_handler: Optional[QueuedRequestHandler]) -> None:
+    """Регистрация /metrics, замера апдейтов и источников для gauge-метрик"""
+    dp.update.outer_middleware(metrics_middleware)
+    IN_FLIGHT.set_function(lambda: completions.in_flight, kind="openai")
+    QUEUE_DEPTH.set_function(lambda: completions.stats()["waiting"], queue="openai")
+    QUEUE_DEPTH.set_function(lambda: log_sink.queue_depth, queue="log_sink")
+    QUEUE_DEPTH.set_function(lambda: chat_queue.pending, queue="chat")
+    if response_cache is not None:
+        CACHE_ENTRIES.set_function(lambda: len(response_cache))
+    if webhook_handler is not None:
+        QUEUE_DEPTH.set_function(lambda: webhook_handler.queue_depth, queue="webhook")
+    app.router.add_get("/metrics", metrics_handler)
+
+def create_app() -> web.Application:
+    """Сборка aiohttp-приложения со всеми хендлерами"""
     app = web.Application()
+    webhook_handler = None
     # Регистрируем хендлер на /bot<Токен>
-    SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=WEBHOOK_PATH)
+    if WEBHOOK_FAST_ACK:
+        webhook_handler = QueuedRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            queue_size=WEBHOOK_QUEUE_SIZE,
+            workers=WEBHOOK_WORKERS,
+            dedup_ttl=WEBHOOK_DEDUP_TTL,
+        )
+        webhook_handler.register(app, path=WEBHOOK_PATH)
+        # Глубина очереди, отклонённые и повторные апдейты
+        app.router.add_get("/stats", lambda request: web.json_response(webhook_handler.stats()))
+    else:
+        SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=WEBHOOK_PATH)
+
+    if METRICS_ENABLED:
+        setup_metrics(app, webhook_handler)
 
     # Для проверки что сервис "живой" (Render Health Check), можно вернуть "OK" на /
     app.router.add_get("/", lambda request: web.Response(text="OK"))
@@ -200,6 +416,10 @@ def main() -> None:
     # Подключаем функции при старте/остановке
     app.on_startup.append(lambda app: on_startup(bot))
     app.on_shutdown.append(lambda app: on_shutdown(bot))
+    return app
+
+def main() -> None:
+    app = create_app()
 
     # Порт для Render
     port = int(os.getenv("PORT", 10000))
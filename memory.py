@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from tokens import MESSAGE_OVERHEAD, count_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_HEADER = "Кратко о том, что собеседница рассказывала раньше:\n"
+_SENTENCE_RE = re.compile(r"^(.+?[.!?…])(\s|$)", re.S)
+
+Turn = Dict[str, Any]
+
+
+class HistoryStore(ABC):
+    """
+    Память разговора по чатам с жёстким бюджетом токенов.
+    Когда история не помещается в бюджет, старые реплики убираются,
+    а первые фразы сообщений пользовательницы складываются в краткую сводку.
+    """
+
+    def __init__(self, token_budget: int = 1500, summary_budget: int = 300) -> None:
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+
+    @abstractmethod
+    async def load(self, chat_id: int) -> List[Dict[str, str]]:
+        """Сообщения для подстановки в запрос между системным промптом и новым вопросом."""
+
+    @abstractmethod
+    async def append(self, chat_id: int, user_text: str, reply_text: str) -> None:
+        """Сохранение очередной пары вопрос-ответ."""
+
+    @abstractmethod
+    async def clear(self, chat_id: int) -> None:
+        """Забыть разговор с чатом."""
+
+    async def close(self) -> None:
+        pass
+
+    @staticmethod
+    def _turn(role: str, content: str) -> Turn:
+        return {"role": role, "content": content, "tokens": count_tokens(content) + MESSAGE_OVERHEAD}
+
+    def _fold(self, summary: str, turn: Turn) -> str:
+        if turn["role"] != "user":
+            return summary
+        text = " ".join(turn["content"].split())
+        match = _SENTENCE_RE.match(text)
+        line = f"— {(match.group(1) if match else text)[:200]}"
+        lines = [item for item in summary.split("\n") if item] + [line]
+        # Сводка не должна вытеснять сами реплики
+        budget = min(self.summary_budget, self.token_budget // 3)
+        while len(lines) > 1 and count_tokens("\n".join(lines)) > budget:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def _compact(self, turns: List[Turn], summary: str) -> Tuple[List[Turn], str]:
+        """Ужимает историю до бюджета, сворачивая самые старые реплики в сводку."""
+        used = sum(turn["tokens"] for turn in turns) + (count_tokens(summary) if summary else 0)
+        while turns and used > self.token_budget:
+            turn = turns.pop(0)
+            summary = self._fold(summary, turn)
+            used = sum(item["tokens"] for item in turns) + count_tokens(summary)
+        return turns, summary
+
+    @staticmethod
+    def _render(turns: List[Turn], summary: str) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": SUMMARY_HEADER + summary}] if summary else []
+        messages.extend({"role": turn["role"], "content": turn["content"]} for turn in turns)
+        return messages
+
+
+class InMemoryHistoryStore(HistoryStore):
+    """
+    История в памяти процесса: LRU по чатам, забывание после idle_ttl секунд
+    без сообщений и общий лимит токенов на всех пользователей.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 1500,
+        summary_budget: int = 300,
+        idle_ttl: float = 24 * 3600,
+        max_chats: int = 10_000,
+        max_total_tokens: int = 5_000_000,
+    ) -> None:
+        super().__init__(token_budget=token_budget, summary_budget=summary_budget)
+        self.idle_ttl = idle_ttl
+        self.max_chats = max_chats
+        self.max_total_tokens = max_total_tokens
+        self.total_tokens = 0
+        self.evicted = 0
+        self._chats: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def _size(self, chat: Dict[str, Any]) -> int:
+        return sum(turn["tokens"] for turn in chat["turns"]) + (count_tokens(chat["summary"]) if chat["summary"] else 0)
+
+    def _drop(self, chat_id: int) -> None:
+        chat = self._chats.pop(chat_id)
+        self.total_tokens -= chat["size"]
+
+    def _expire(self) -> None:
+        # Чаты лежат в порядке последней активности, самые давние — в начале
+        deadline = time.monotonic() - self.idle_ttl
+        while self._chats:
+            chat_id, chat = next(iter(self._chats.items()))
+            if chat["seen"] >= deadline:
+                break
+            self._drop(chat_id)
+
+    async def load(self, chat_id: int) -> List[Dict[str, str]]:
+        self._expire()
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            return []
+        return self._render(chat["turns"], chat["summary"])
+
+    async def append(self, chat_id: int, user_text: str, reply_text: str) -> None:
+        self._expire()
+        chat = self._chats.pop(chat_id, None)
+        if chat is None:
+            chat = {"turns": [], "summary": "", "size": 0}
+        self.total_tokens -= chat["size"]
+        chat["turns"].extend([self._turn("user", user_text), self._turn("assistant", reply_text)])
+        chat["turns"], chat["summary"] = self._compact(chat["turns"], chat["summary"])
+        chat["size"] = self._size(chat)
+        chat["seen"] = time.monotonic()
+        self._chats[chat_id] = chat
+        self.total_tokens += chat["size"]
+
+        # Общий лимит: забываем самые давние разговоры
+        while len(self._chats) > 1 and (
+            len(self._chats) > self.max_chats or self.total_tokens > self.max_total_tokens
+        ):
+            self._drop(next(iter(self._chats)))
+            self.evicted += 1
+
+    async def clear(self, chat_id: int) -> None:
+        if chat_id in self._chats:
+            self._drop(chat_id)
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """История в SQLite: переживает перезапуск. Запросы к базе выполняются в отдельном потоке."""
+
+    def __init__(
+        self,
+        path: str,
+        token_budget: int = 1500,
+        summary_budget: int = 300,
+        idle_ttl: float = 24 * 3600,
+        max_chats: int = 100_000,
+    ) -> None:
+        super().__init__(token_budget=token_budget, summary_budget=summary_budget)
+        self.idle_ttl = idle_ttl
+        self.max_chats = max_chats
+        self._lock = threading.Lock()
+        self._appends = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.executescript(
+                """
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS conversations (
+                    chat_id INTEGER PRIMARY KEY,
+                    summary TEXT NOT NULL DEFAULT '',
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS turns (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    tokens INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS turns_chat_id ON turns (chat_id, id);
+                CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at);
+                """
+            )
+
+    def _read(self, chat_id: int) -> Tuple[List[Turn], str, Optional[float]]:
+        row = self._db.execute(
+            "SELECT summary, updated_at FROM conversations WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        if row is None:
+            return [], "", None
+        turns = [
+            {"role": role, "content": content, "tokens": tokens}
+            for role, content, tokens in self._db.execute(
+                "SELECT role, content, tokens FROM turns WHERE chat_id = ? ORDER BY id", (chat_id,)
+            )
+        ]
+        return turns, row[0], row[1]
+
+    def _delete(self, chat_id: int) -> None:
+        self._db.execute("DELETE FROM turns WHERE chat_id = ?", (chat_id,))
+        self._db.execute("DELETE FROM conversations WHERE chat_id = ?", (chat_id,))
+
+    def _load_sync(self, chat_id: int) -> List[Dict[str, str]]:
+        with self._lock:
+            turns, summary, updated_at = self._read(chat_id)
+            if updated_at is not None and time.time() - updated_at > self.idle_ttl:
+                with self._db:
+                    self._delete(chat_id)
+                return []
+            return self._render(turns, summary)
+
+    def _append_sync(self, chat_id: int, user_text: str, reply_text: str) -> None:
+        with self._lock, self._db:
+            turns, summary, updated_at = self._read(chat_id)
+            if updated_at is not None and time.time() - updated_at > self.idle_ttl:
+                turns, summary = [], ""
+            turns.extend([self._turn("user", user_text), self._turn("assistant", reply_text)])
+            turns, summary = self._compact(turns, summary)
+
+            self._delete(chat_id)
+            self._db.execute(
+                "INSERT INTO conversations (chat_id, summary, updated_at) VALUES (?, ?, ?)",
+                (chat_id, summary, time.time()),
+            )
+            self._db.executemany(
+                "INSERT INTO turns (chat_id, role, content, tokens) VALUES (?, ?, ?, ?)",
+                [(chat_id, turn["role"], turn["content"], turn["tokens"]) for turn in turns],
+            )
+
+            # Периодически чистим заброшенные разговоры и лишние чаты
+            self._appends += 1
+            if self._appends % 100 == 0:
+                self._cleanup()
+
+    def _cleanup(self) -> None:
+        stale = [
+            chat_id
+            for (chat_id,) in self._db.execute(
+                """
+                SELECT chat_id FROM conversations
+                WHERE updated_at < ? OR chat_id IN (
+                    SELECT chat_id FROM conversations ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (time.time() - self.idle_ttl, self.max_chats),
+            )
+        ]
+        for chat_id in stale:
+            self._delete(chat_id)
+        if stale:
+            logger.info(f"Удалено старых разговоров из истории: {len(stale)}")
+
+    def _clear_sync(self, chat_id: int) -> None:
+        with self._lock, self._db:
+            self._delete(chat_id)
+
+    async def load(self, chat_id: int) -> List[Dict[str, str]]:
+        return await asyncio.to_thread(self._load_sync, chat_id)
+
+    async def append(self, chat_id: int, user_text: str, reply_text: str) -> None:
+        await asyncio.to_thread(self._append_sync, chat_id, user_text, reply_text)
+
+    async def clear(self, chat_id: int) -> None:
+        await asyncio.to_thread(self._clear_sync, chat_id)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,210 @@
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Границы корзин гистограмм по умолчанию, в секундах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric(ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Строки с значениями метрики в текстовом формате Prometheus."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(Metric):
+    """Текущее значение: задаётся явно или читается из функции при каждом сборе."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels: str) -> None:
+        self._functions[self._key(labels)] = function
+
+    def samples(self) -> List[str]:
+        values = dict(self._values)
+        for key, function in self._functions.items():
+            values[key] = function()
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам, как в prometheus_client."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # На каждую метку: счётчики корзин (последняя — +Inf), сумма
+        self._data: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        data = self._data.get(key)
+        if data is None:
+            data = self._data[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        data[0][bisect_left(self.buckets, value)] += 1
+        data[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._data.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+UPDATE_SECONDS = REGISTRY.register(Histogram(
+    "bot_update_duration_seconds", "Время обработки апдейта диспетчером, от начала разбора до ответа",
+))
+OPENAI_SECONDS = REGISTRY.register(Histogram(
+    "bot_openai_request_duration_seconds",
+    "Длительность попытки запроса к OpenAI, для потоковых ответов — до последнего куска",
+    ("model", "outcome"),
+))
+TOKENS = REGISTRY.register(Histogram(
+    "bot_tokens_per_request", "Токены на один запрос к OpenAI", ("model", "kind"), buckets=TOKEN_BUCKETS,
+))
+TELEGRAM_SEND_SECONDS = REGISTRY.register(Histogram(
+    "bot_telegram_send_duration_seconds", "Задержка отправки и редактирования сообщений в Telegram",
+))
+LOG_SINK_SECONDS = REGISTRY.register(Histogram(
+    "bot_log_sink_send_duration_seconds", "Задержка отправки пачки логов во второй бот",
+))
+ERRORS = REGISTRY.register(Counter(
+    "bot_errors_total", "Ошибки по типам", ("type",),
+))
+RATE_LIMITED = REGISTRY.register(Counter(
+    "bot_rate_limited_total", "Ответы 429 от внешних сервисов", ("upstream",),
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "bot_response_cache_lookups_total", "Обращения к кэшу ответов: hit, near_hit, miss", ("result",),
+))
+CACHE_EVICTIONS = REGISTRY.register(Counter(
+    "bot_response_cache_evictions_total", "Ответы, вытесненные из переполненного кэша",
+))
+CACHE_ENTRIES = REGISTRY.register(Gauge(
+    "bot_response_cache_entries", "Число ответов в кэше",
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "bot_in_flight_requests", "Запросы, обрабатываемые прямо сейчас", ("kind",),
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "bot_queue_depth", "Глубина внутренних очередей", ("queue",),
+))
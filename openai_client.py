@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Optional
+
+import aiohttp
+import openai
+
+from completion_scheduler import CompletionScheduler
+from metrics import OPENAI_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых запрос имеет смысл повторить.
+# RateLimitError сюда не входит: на 429 реагирует CompletionScheduler.
+TRANSIENT_ERRORS = (
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+    asyncio.TimeoutError,
+)
+
+
+class CircuitOpenError(Exception):
+    """OpenAI сейчас недоступен, запрос не отправлялся."""
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold ошибок подряд размыкается на reset_timeout секунд.
+    Затем пропускает один пробный запрос: успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> None:
+        state = self.state
+        if state == "open" or (state == "half-open" and self._probe_in_flight):
+            raise CircuitOpenError("OpenAI временно недоступен")
+        if state == "half-open":
+            self._probe_in_flight = True
+
+    def on_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("OpenAI снова отвечает, цепь замкнута")
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def abandon(self) -> None:
+        """Пробный запрос отменён, не дождавшись ответа"""
+        self._probe_in_flight = False
+
+    def on_failure(self) -> None:
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.error(f"OpenAI недоступен ({self.failures} ошибок подряд), цепь разомкнута")
+            self.opened_at = time.monotonic()
+
+
+class OpenAIClient:
+    """
+    Обёртка над openai.ChatCompletion.acreate: постоянный пул соединений,
+    таймаут на каждую попытку и общий дедлайн на запрос вместе с повторами
+    и чтением потока, повторы с джиттером, хеджирование медленных запросов
+    и автомат защиты при недоступности OpenAI.
+
+    Хеджированный дубль занимает отдельный слот в slots; если свободного
+    слота нет, дубль не отправляется.
+    """
+
+    def __init__(
+        self,
+        timeout: float = 60.0,
+        deadline: float = 90.0,
+        max_retries: int = 2,
+        backoff: float = 0.5,
+        hedge: bool = False,
+        hedge_percentile: float = 0.95,
+        pool_size: int = 100,
+        breaker: Optional[CircuitBreaker] = None,
+        slots: Optional[CompletionScheduler] = None,
+    ) -> None:
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+        self.slots = slots
+        self.hedged = 0
+        self._latencies: Deque[float] = deque(maxlen=200)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> None:
+        """Создание общего пула соединений"""
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge or len(self._latencies) < 20:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))]
+
+    async def _attempt(self, params: Any, timeout: float) -> Any:
+        # aiosession — ContextVar, поэтому выставляем его в контексте каждого запроса
+        if self._session is not None:
+            openai.aiosession.set(self._session)
+        return await asyncio.wait_for(
+            openai.ChatCompletion.acreate(request_timeout=timeout, **params),
+            timeout=timeout,
+        )
+
+    async def _hedged_attempt(self, params: Any, timeout: float) -> Any:
+        delay = None if params.get("stream") else self._hedge_delay()
+        if delay is None or delay >= timeout:
+            return await self._attempt(params, timeout)
+
+        first = asyncio.create_task(self._attempt(params, timeout))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        # Первый запрос дольше обычного — параллельно отправляем второй,
+        # если планировщик готов выделить под него слот
+        if self.slots is not None and not self.slots.try_acquire():
+            return await first
+        self.hedged += 1
+        second = asyncio.create_task(self._attempt(params, timeout - delay))
+        if self.slots is not None:
+            second.add_done_callback(lambda task: self.slots.release())
+        pending = {first, second}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                if not pending:
+                    # Оба запроса упали — пробрасываем ошибку
+                    return done.pop().result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _is_transient(self, error: Exception) -> bool:
+        if isinstance(error, TRANSIENT_ERRORS):
+            return True
+        return isinstance(error, openai.error.APIError) and (error.http_status or 0) >= 500
+
+    def _on_error(self, error: Exception) -> bool:
+        """Учёт ошибки в автомате защиты. Возвращает True, если ошибка временная."""
+        if not self._is_transient(error):
+            # OpenAI ответил (например, 400 или 429) — значит, он доступен
+            self.breaker.on_success()
+            return False
+        self.breaker.on_failure()
+        return True
+
+    async def create(self, **params: Any) -> Any:
+        """Аналог openai.ChatCompletion.acreate с повторами и защитой."""
+        self.breaker.before_call()
+        deadline = time.monotonic() + self.deadline
+        model = params.get("model", "")
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = await self._hedged_attempt(params, min(self.timeout, deadline - started))
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                raise
+            except Exception as e:
+                OPENAI_SECONDS.observe(time.monotonic() - started, model=model, outcome="error")
+                if not self._on_error(e):
+                    raise
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                # Повтор не успеет до общего дедлайна — сдаёмся сразу
+                if attempt >= self.max_retries or self.breaker.state == "open" or time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                logger.warning(f"Временная ошибка OpenAI ({type(e).__name__}), повтор {attempt} через {delay:.1f} с")
+                await asyncio.sleep(delay)
+                continue
+            if params.get("stream"):
+                # Исход и длительность запроса станут известны только после чтения всего потока
+                return self._stream(response, deadline, model, started)
+            latency = time.monotonic() - started
+            OPENAI_SECONDS.observe(latency, model=model, outcome="ok")
+            self.breaker.on_success()
+            self._latencies.append(latency)
+            return response
+
+    async def _stream(self, response: Any, deadline: float, model: str, started: float) -> AsyncIterator[Any]:
+        """Чтение потока с тем же дедлайном; обрыв потока засчитывается автомату защиты."""
+        try:
+            while True:
+                timeout = min(self.timeout, deadline - time.monotonic())
+                try:
+                    chunk = await asyncio.wait_for(response.__anext__(), timeout=max(timeout, 0))
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            self.breaker.abandon()
+            raise
+        except Exception as e:
+            OPENAI_SECONDS.observe(time.monotonic() - started, model=model, outcome="error")
+            self._on_error(e)
+            raise
+        else:
+            OPENAI_SECONDS.observe(time.monotonic() - started, model=model, outcome="ok")
+            self.breaker.on_success()
+        finally:
+            await response.aclose()
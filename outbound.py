@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import re
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple, TypeVar
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import RATE_LIMITED, TELEGRAM_SEND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Максимальная длина одной части ответа
+MESSAGE_LIMIT = 4000
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def block(self, seconds: float) -> None:
+        """Запрет отправки на seconds секунд (ответ 429 от Telegram)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def is_idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OutboundScheduler:
+    """
+    Единая точка отправки в Telegram: общий лимит на весь бот
+    и отдельный лимит на каждый чат, повтор после 429 с учётом retry_after.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_retries: int = 3,
+        max_idle_chats: int = 10_000,
+    ) -> None:
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_idle_chats = max_idle_chats
+        self.retry_after_count = 0
+        self._chats: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_idle_chats:
+                # Полные вёдра ничего не ограничивают, их можно забыть
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_idle()}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def send(self, chat_id: int, call: Callable[[], Awaitable[T]]) -> T:
+        """Выполнить call (отправку или редактирование) с соблюдением лимитов."""
+        bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                with TELEGRAM_SEND_SECONDS.time():
+                    return await call()
+            except TelegramRetryAfter as e:
+                self.retry_after_count += 1
+                RATE_LIMITED.inc(upstream="telegram")
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logger.warning(f"Лимит Telegram для чата {chat_id}, жду {e.retry_after} с")
+                bucket.block(e.retry_after)
+
+
+# Теги и HTML-сущности, внутри которых резать текст нельзя. Последняя альтернатива —
+# тег, который ещё не дописан (при стриминге текст обрывается посреди генерации)
+_MARKUP_RE = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^<>]*>|&#?\w+;|</?[a-zA-Z][^<>]*$")
+# Границы, по которым режем, в порядке предпочтения
+_BOUNDARIES = (
+    re.compile(r"\n\s*\n"),
+    re.compile(r"\n"),
+    re.compile(r"[.!?…]+[»\"')]*\s"),
+    re.compile(r"\s"),
+)
+
+
+def _open_tags(text: str) -> List[Tuple[str, str]]:
+    """Стек незакрытых тегов: (имя, исходный открывающий тег)."""
+    stack: List[Tuple[str, str]] = []
+    for match in _MARKUP_RE.finditer(text):
+        closing, name = match.group(1), match.group(2)
+        if name is None:
+            continue
+        name = name.lower()
+        if not closing:
+            stack.append((name, match.group(0)))
+            continue
+        for index in range(len(stack) - 1, -1, -1):
+            if stack[index][0] == name:
+                del stack[index:]
+                break
+    return stack
+
+
+def _find_cut(text: str, budget: int, start: int = 0) -> int:
+    """Позиция разреза в (start, budget]: абзац, строка, предложение, пробел."""
+    # Разметку ищем по всему тексту: тег, начавшийся до budget, может заканчиваться после него
+    protected = []
+    for match in _MARKUP_RE.finditer(text):
+        if match.start() >= budget:
+            break
+        protected.append(match.span())
+
+    def allowed(position: int) -> bool:
+        return all(not (start < position < end) for start, end in protected)
+
+    window = text[:budget]
+    for boundary in _BOUNDARIES:
+        for match in reversed(list(boundary.finditer(window))):
+            position = match.end()
+            if position > start and allowed(position):
+                return position
+    position = budget
+    while position > start + 1 and not allowed(position):
+        position -= 1
+    return position
+
+
+def split_html(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Нарезка текста с HTML-разметкой на части не длиннее limit.
+    Режем по абзацам и предложениям, не разрываем теги и сущности,
+    незакрытые теги закрываем в конце части и открываем заново в следующей.
+    """
+    chunks: List[str] = []
+    opening = ""
+    while len(text) > limit:
+        budget = limit
+        while True:
+            cut = _find_cut(text, budget, start=len(opening))
+            stack = _open_tags(text[:cut])
+            if sum(len(tag) + len(name) + 3 for name, tag in stack) > limit // 2:
+                # Разметка явно сломана, переносить такие теги бессмысленно
+                stack = []
+            closing = "".join(f"</{name}>" for name, _ in reversed(stack))
+            head = text[:cut].rstrip()
+            if len(head) + len(closing) <= limit or budget <= len(opening) + 1:
+                break
+            budget -= len(head) + len(closing) - limit
+        chunks.append(head + closing)
+        opening = "".join(tag for _, tag in stack)
+        text = opening + text[cut:].lstrip()
+    if text.strip():
+        chunks.append(text)
+    return chunks
@@ -0,0 +1,163 @@
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+from metrics import TOKENS
+from response_cache import fingerprint
+from tokens import MESSAGE_OVERHEAD, count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Цена за 1000 токенов в долларах: (запрос, ответ).
+# gpt-3.5-turbo указывает на gpt-3.5-turbo-0125 с окном 16k; старая
+# gpt-3.5-turbo-16k (0613) — та же модель, но в 6 раз дороже на входе
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4o": (0.0025, 0.01),
+}
+
+# Размер контекстного окна моделей в токенах
+MODEL_CONTEXT = {
+    "gpt-4o-mini": 128_000,
+    "gpt-3.5-turbo": 16_385,
+    "gpt-3.5-turbo-16k": 16_385,
+    "gpt-4o": 128_000,
+}
+
+_GREETING_RE = re.compile(
+    r"^\W*(привет\w*|здравствуй\w*|добр\w+ (утро|день|вечер)|хай|хелло|hi|hello|спасибо|благодарю|пока|"
+    r"доброй ночи|ок|окей|понятно|ясно)\W*$",
+    re.I,
+)
+
+
+class Prompt:
+    """Системный промпт, подготовленный один раз при запуске."""
+
+    def __init__(self, name: str, text: str, model: str = "gpt-3.5-turbo") -> None:
+        self.name = name
+        self.text = text
+        self.tokens = count_tokens(text, model) + MESSAGE_OVERHEAD
+        self.fingerprint = fingerprint(name, text)
+        self.message = {"role": "system", "content": text}
+
+
+class PromptRegistry:
+    """Все варианты системного промпта с заранее посчитанными токенами."""
+
+    def __init__(self) -> None:
+        self._prompts: Dict[str, Prompt] = {}
+
+    def register(self, name: str, text: str) -> Prompt:
+        prompt = self._prompts[name] = Prompt(name, text)
+        logger.info(f"Промпт {name}: {prompt.tokens} токенов")
+        return prompt
+
+    def __getitem__(self, name: str) -> Prompt:
+        return self._prompts[name]
+
+
+class Route:
+    """Маршрут запроса: модель, промпт и потолок длины ответа."""
+
+    def __init__(self, name: str, model: str, prompt: Prompt, max_tokens: int) -> None:
+        self.name = name
+        self.model = model
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.context = MODEL_CONTEXT.get(model, 4096)
+        # Для кэша: тот же промпт и та же модель дают взаимозаменяемые ответы
+        self.fingerprint = fingerprint(prompt.fingerprint, model, max_tokens)
+
+
+class RequestPlan:
+    """Готовый к отправке запрос с учётом бюджета токенов."""
+
+    def __init__(self, route: Route, messages: List[Dict[str, str]], input_tokens: int, max_tokens: int) -> None:
+        self.route = route
+        self.messages = messages
+        self.input_tokens = input_tokens
+        self.max_tokens = max_tokens
+
+    def params(self) -> Dict[str, Any]:
+        return {"model": self.route.model, "messages": self.messages, "max_tokens": self.max_tokens}
+
+
+class ModelRouter:
+    """
+    Выбор модели по длине и характеру сообщения: короткие приветствия —
+    самой дешёвой модели с коротким ответом, длинные вопросы — более мощной.
+    max_tokens ужимается до места, оставшегося в контекстном окне.
+    """
+
+    def __init__(
+        self,
+        greeting: Route,
+        default: Route,
+        long: Route,
+        long_question_tokens: int = 300,
+        min_answer_tokens: int = 200,
+    ) -> None:
+        self.greeting = greeting
+        self.default = default
+        self.long = long
+        self.long_question_tokens = long_question_tokens
+        self.min_answer_tokens = min_answer_tokens
+
+    def _select(self, text: str, question_tokens: int) -> Route:
+        if _GREETING_RE.match(text.strip()):
+            return self.greeting
+        if question_tokens >= self.long_question_tokens:
+            return self.long
+        return self.default
+
+    def plan(self, text: str, history: List[Dict[str, str]]) -> RequestPlan:
+        question_tokens = count_tokens(text) + MESSAGE_OVERHEAD
+        history_tokens = sum(count_tokens(item["content"]) + MESSAGE_OVERHEAD for item in history)
+        route = self._select(text, question_tokens)
+
+        def budget(candidate: Route) -> int:
+            return candidate.context - candidate.prompt.tokens - history_tokens - question_tokens - 3
+
+        # Не помещается в окно дешёвой модели — переходим на модель с большим окном
+        if budget(route) < self.min_answer_tokens and route is not self.long:
+            route = self.long
+
+        input_tokens = route.prompt.tokens + history_tokens + question_tokens + 3
+        max_tokens = max(1, min(route.max_tokens, budget(route)))
+        messages = [route.prompt.message, *history, {"role": "user", "content": text}]
+        return RequestPlan(route, messages, input_tokens, max_tokens)
+
+
+class UsageTracker:
+    """Учёт токенов и стоимости запросов по моделям."""
+
+    def __init__(self) -> None:
+        self.totals: Dict[str, Dict[str, float]] = {}
+
+    def record(
+        self,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        route: Optional[str] = None,
+    ) -> float:
+        """Добавляет запрос в статистику и возвращает его стоимость в долларах."""
+        prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+        cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+        totals = self.totals.setdefault(
+            model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0}
+        )
+        totals["requests"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += completion_tokens
+        totals["cost"] += cost
+        TOKENS.observe(prompt_tokens, model=model, kind="prompt")
+        TOKENS.observe(completion_tokens, model=model, kind="completion")
+        logger.info(
+            f"Токены: маршрут={route}, модель={model}, запрос={prompt_tokens}, "
+            f"ответ={completion_tokens}, стоимость=${cost:.5f}"
+        )
+        return cost
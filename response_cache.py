@@ -0,0 +1,195 @@
+import hashlib
+import logging
+import random
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from metrics import CACHE_EVICTIONS, CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+_DIGITS_RE = re.compile(r"\d+")
+# Слова, которые переворачивают смысл вопроса при почти том же тексте
+NEGATIONS = frozenset({"не", "нет", "ни"})
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize(text: str) -> str:
+    """Нормализация вопроса: регистр, ё, пунктуация и лишние пробелы не важны."""
+    text = text.lower().replace("ё", "е")
+    return " ".join(_PUNCTUATION_RE.sub(" ", text).split())
+
+
+def guard_tokens(normalized: str) -> frozenset:
+    """Числа и отрицания вопроса: похожими считаются только вопросы с одинаковым набором."""
+    words = normalized.split()
+    return frozenset(_DIGITS_RE.findall(normalized)) | frozenset(word for word in words if word in NEGATIONS)
+
+
+def fingerprint(*parts: Any) -> str:
+    """Отпечаток промпта и параметров модели: при их смене старые ответы не подходят."""
+    return hashlib.sha256("\x00".join(map(str, parts)).encode()).hexdigest()[:16]
+
+
+class MinHasher:
+    """MinHash по символьным шинглам: похожие тексты дают похожие сигнатуры."""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 4, seed: int = 1) -> None:
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)
+        ]
+
+    def shingles(self, text: str) -> Set[int]:
+        size = self.shingle_size
+        if len(text) <= size:
+            return {zlib.crc32(text.encode())}
+        return {zlib.crc32(text[i:i + size].encode()) for i in range(len(text) - size + 1)}
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        shingles = self.shingles(text)
+        return tuple(min((a * value + b) % _MERSENNE_PRIME for value in shingles) for a, b in self._perms)
+
+    @staticmethod
+    def similarity(left: Tuple[int, ...], right: Tuple[int, ...]) -> float:
+        return sum(1 for a, b in zip(left, right) if a == b) / len(left)
+
+
+class ResponseCache:
+    """
+    Кэш ответов на одинаковые и почти одинаковые вопросы.
+
+    Точное совпадение ищется по нормализованному тексту и отпечатку промпта,
+    похожие вопросы — через MinHash с LSH-корзинами. Похожий вопрос подходит,
+    только если в нём те же числа и отрицания («мне 15 лет» и «мне 25 лет»,
+    «хочу» и «не хочу» — разные вопросы). Записи живут ttl секунд,
+    при переполнении вытесняются давно не использованные.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 24 * 3600,
+        max_entries: int = 5000,
+        similarity: float = 0.85,
+        min_fuzzy_length: int = 20,
+        num_perm: int = 64,
+        bands: int = 16,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.min_fuzzy_length = min_fuzzy_length
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm=num_perm)
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], Set[Tuple[str, str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики попаданий и промахов для мониторинга."""
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _band_keys(self, prompt: str, signature: Tuple[int, ...]) -> List[Tuple[str, int, Tuple[int, ...]]]:
+        return [
+            (prompt, band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)
+        ]
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(key)
+        for band_key in entry["bands"]:
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def _live(self, key: Tuple[str, str], now: float) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["expires"] <= now:
+            self._remove(key)
+            return None
+        return entry
+
+    def get(self, prompt: str, text: str) -> Optional[str]:
+        """Сохранённый ответ на такой же или очень похожий вопрос."""
+        now = time.monotonic()
+        normalized = normalize(text)
+        key = (prompt, normalized)
+
+        entry = self._live(key, now)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.inc(result="hit")
+            return entry["response"]
+
+        if len(normalized) >= self.min_fuzzy_length:
+            signature = self.hasher.signature(normalized)
+            guard = guard_tokens(normalized)
+            candidates: Set[Tuple[str, str]] = set()
+            for band_key in self._band_keys(prompt, signature):
+                candidates.update(self._buckets.get(band_key, ()))
+            best_key, best_score = None, self.similarity
+            for candidate in candidates:
+                candidate_entry = self._live(candidate, now)
+                if candidate_entry is None or candidate_entry["guard"] != guard:
+                    continue
+                score = MinHasher.similarity(signature, candidate_entry["signature"])
+                if score >= best_score:
+                    best_key, best_score = candidate, score
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.near_hits += 1
+                CACHE_LOOKUPS.inc(result="near_hit")
+                logger.info(f"Ответ из кэша для похожего вопроса (сходство {best_score:.2f})")
+                return self._entries[best_key]["response"]
+
+        self.misses += 1
+        CACHE_LOOKUPS.inc(result="miss")
+        return None
+
+    def put(self, prompt: str, text: str, response: str) -> None:
+        normalized = normalize(text)
+        key = (prompt, normalized)
+        if key in self._entries:
+            self._remove(key)
+
+        signature: Tuple[int, ...] = ()
+        bands: List[Tuple[str, int, Tuple[int, ...]]] = []
+        if len(normalized) >= self.min_fuzzy_length:
+            signature = self.hasher.signature(normalized)
+            bands = self._band_keys(prompt, signature)
+            for band_key in bands:
+                self._buckets.setdefault(band_key, set()).add(key)
+
+        self._entries[key] = {
+            "response": response,
+            "expires": time.monotonic() + self.ttl,
+            "signature": signature,
+            "guard": guard_tokens(normalized),
+            "bands": bands,
+        }
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+            CACHE_EVICTIONS.inc()
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import openai
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+
+from outbound import OutboundScheduler, split_html
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PLACEHOLDER = "…"
+
+
+class EditThrottle:
+    """Не больше одного редактирования в interval секунд на каждый чат."""
+
+    def __init__(self, interval: float = 1.0) -> None:
+        self.interval = interval
+        self._last_edit: Dict[int, float] = {}
+
+    def ready(self, chat_id: int) -> bool:
+        return time.monotonic() - self._last_edit.get(chat_id, 0.0) >= self.interval
+
+    async def wait(self, chat_id: int) -> None:
+        delay = self.interval - (time.monotonic() - self._last_edit.get(chat_id, 0.0))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def touch(self, chat_id: int) -> None:
+        self._last_edit[chat_id] = time.monotonic()
+
+
+edit_throttle = EditThrottle()
+
+
+class StreamingReply:
+    """Ответ, который заполняется по мере прихода токенов от OpenAI."""
+
+    def __init__(
+        self,
+        message: Message,
+        throttle: EditThrottle = edit_throttle,
+        scheduler: Optional[OutboundScheduler] = None,
+    ) -> None:
+        self.message = message
+        self.chat_id = message.chat.id
+        self.throttle = throttle
+        self.scheduler = scheduler
+        self.text = ""
+        self._sent: List[Message] = []
+        self._shown: List[str] = []
+
+    def _chunks(self, text: str) -> List[str]:
+        # Та же нарезка, что и при отправке готового ответа
+        return split_html(text) or [PLACEHOLDER]
+
+    async def _call(self, call: Callable[[], Awaitable[T]]) -> T:
+        if self.scheduler is None:
+            return await call()
+        return await self.scheduler.send(self.chat_id, call)
+
+    async def start(self) -> None:
+        """Отправка заглушки, которую потом будем редактировать"""
+        self._sent.append(await self._call(lambda: self.message.answer(PLACEHOLDER)))
+        self._shown.append(PLACEHOLDER)
+
+    async def _edit(self, index: int, chunk: str, wait: bool) -> None:
+        if self._shown[index] == chunk:
+            return
+        if wait:
+            await self.throttle.wait(self.chat_id)
+        elif not self.throttle.ready(self.chat_id):
+            return
+        try:
+            await self._call(lambda: self._sent[index].edit_text(chunk))
+            self._shown[index] = chunk
+        except TelegramBadRequest as e:
+            if wait:
+                raise
+            # Незакрытый HTML-тег в середине генерации — дождёмся следующего куска
+            logger.debug(f"Промежуточное редактирование не удалось: {e}")
+        self.throttle.touch(self.chat_id)
+
+    async def _render(self, text: str, final: bool = False) -> None:
+        chunks = self._chunks(text)
+        for index, chunk in enumerate(chunks):
+            if index < len(self._sent):
+                # Заполненные сообщения и итоговый текст дописываем обязательно,
+                # текущее сообщение — только если позволяет ограничение частоты
+                must_edit = final or index < len(chunks) - 1
+                await self._edit(index, chunk, wait=must_edit)
+            else:
+                # Текст перевалил за лимит — продолжаем в новом сообщении. Незаконченный
+                # хвост может содержать оборванный тег, поэтому сначала шлём заглушку,
+                # а текст подставляем редактированием, как и в первом сообщении
+                self._sent.append(await self._call(lambda: self.message.answer(PLACEHOLDER)))
+                self._shown.append(PLACEHOLDER)
+                self.throttle.touch(self.chat_id)
+                if final:
+                    await self._edit(index, chunk, wait=True)
+
+    async def discard(self) -> None:
+        """Удаление заглушки, если ответа так и не будет"""
+        for sent in self._sent:
+            try:
+                await self._call(sent.delete)
+            except TelegramBadRequest as e:
+                logger.warning(f"Не удалось удалить заглушку: {e}")
+        self._sent = []
+        self._shown = []
+
+    async def feed(self, delta: str) -> None:
+        self.text += delta
+        # Нарезка всего текста дорогая, а показать его всё равно можно не чаще раза в interval
+        if self.throttle.ready(self.chat_id):
+            await self._render(self.text.strip())
+
+    async def finish(self) -> str:
+        self.text = self.text.strip()
+        await self._render(self.text, final=True)
+        # Граница частей могла сдвинуться — лишние сообщения убираем
+        for extra in self._sent[len(self._chunks(self.text)):]:
+            try:
+                await self._call(extra.delete)
+            except TelegramBadRequest as e:
+                logger.warning(f"Не удалось удалить лишнюю часть ответа: {e}")
+        return self.text
+
+
+async def stream_completion(
+    message: Message,
+    scheduler: Optional[OutboundScheduler] = None,
+    create: Callable[..., Awaitable[Any]] = openai.ChatCompletion.acreate,
+    on_first_token: Optional[Callable[[float], None]] = None,
+    **params: Any,
+) -> str:
+    """
+    Запрос к OpenAI с stream=True и постепенным редактированием ответа в чате.
+    Возвращает итоговый текст, совпадающий с обычным (не потоковым) ответом.
+    on_first_token получает время от запроса до первого токена.
+    """
+    reply = StreamingReply(message, scheduler=scheduler)
+    await reply.start()
+    started = time.monotonic()
+    try:
+        response = await create(stream=True, **params)
+    except Exception:
+        # Генерация не началась — заглушка пользователю не нужна
+        await reply.discard()
+        raise
+    try:
+        async for chunk in response:
+            delta = chunk.choices[0].delta.get("content")
+            if delta:
+                if on_first_token is not None and not reply.text:
+                    on_first_token(time.monotonic() - started)
+                await reply.feed(delta)
+    except Exception:
+        # Поток оборвался на середине — недописанный ответ убираем, пользователь получит сообщение об ошибке
+        await reply.discard()
+        raise
+    return await reply.finish()
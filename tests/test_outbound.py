@@ -0,0 +1,90 @@
+import re
+
+import pytest
+
+from outbound import split_html
+
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^<>]*>")
+
+
+def assert_valid_html(chunk: str) -> None:
+    """Теги закрыты в правильном порядке, нет оборванных тегов и сущностей."""
+    stack = []
+    for match in _TAG_RE.finditer(chunk):
+        closing, name = match.group(1), match.group(2).lower()
+        if closing:
+            assert stack and stack[-1] == name, chunk
+            stack.pop()
+        else:
+            stack.append(name)
+    assert not stack, chunk
+    assert "<" not in _TAG_RE.sub("", chunk), chunk
+    assert not re.search(r"&#?\w*$", chunk), chunk
+
+
+def visible_words(chunks):
+    text = " ".join(_TAG_RE.sub("", chunk) for chunk in chunks)
+    return text.split()
+
+
+def test_short_text_is_not_split():
+    assert split_html("Привет, <b>подруга</b>!", 100) == ["Привет, <b>подруга</b>!"]
+
+
+def test_tag_straddling_the_limit_is_not_cut():
+    text = "слово " * 10 + '<a href="https://example.com/x">ссылка</a> ' + "слово " * 10
+    chunks = split_html(text, 63)
+    assert chunks[0] == ("слово " * 10).strip()
+    assert chunks[1].startswith('<a href="https://example.com/x">ссылка</a>')
+    for chunk in chunks:
+        assert len(chunk) <= 63
+        assert_valid_html(chunk)
+    assert visible_words(chunks) == visible_words([text])
+
+
+@pytest.mark.parametrize("entity", ["&amp;", "&lt;", "&#128522;"])
+def test_entity_straddling_the_limit_is_not_cut(entity):
+    text = "a" * 58 + " x" + entity + "y z"
+    chunks = split_html(text, 62)
+    for chunk in chunks:
+        assert len(chunk) <= 62
+        assert_valid_html(chunk)
+    assert any(entity in chunk for chunk in chunks)
+
+
+def test_open_tags_are_closed_and_reopened():
+    text = '<b>жирный <i>курсив</i> <a href="https://example.com">' + "текст ссылки " * 20 + "</a></b> конец"
+    chunks = split_html(text, 120)
+    assert len(chunks) > 2
+    for chunk in chunks:
+        assert len(chunk) <= 120
+        assert_valid_html(chunk)
+    for chunk in chunks[1:-1]:
+        assert chunk.startswith('<b><a href="https://example.com">')
+        assert chunk.endswith("</a></b>")
+    assert visible_words(chunks) == visible_words([text])
+
+
+def test_prefers_paragraph_then_sentence_boundaries():
+    first = "Первый абзац. " * 3
+    text = first.strip() + "\n\n" + "Второй абзац, длинное предложение. Ещё одно." * 2
+    chunks = split_html(text, len(first) + 10)
+    assert chunks[0] == first.strip()
+    assert chunks[1].startswith("Второй абзац")
+
+
+def test_unfinished_tag_at_the_end_of_streamed_text_stays_whole():
+    text = "текст " * 10 + '<a href="https://exa'
+    chunks = split_html(text, 63)
+    assert chunks[-1] == '<a href="https://exa'
+    for chunk in chunks[:-1]:
+        assert_valid_html(chunk)
+
+
+def test_long_reply_fits_telegram_limit():
+    text = ("Абзац <b>жирный текст</b> и обычный текст &amp; символы. " * 20 + "\n\n") * 15
+    chunks = split_html(text)
+    for chunk in chunks:
+        assert len(chunk) <= 4000
+        assert_valid_html(chunk)
+    assert visible_words(chunks) == visible_words([text])
@@ -0,0 +1,48 @@
+import pytest
+
+from response_cache import ResponseCache, guard_tokens, normalize
+
+PROMPT = "prompt"
+
+OPPOSITE_PAIRS = [
+    (
+        "Я хочу заниматься сексом с моим партнёром, что мне делать?",
+        "Я не хочу заниматься сексом с моим партнёром, что мне делать?",
+    ),
+    (
+        "Мне не больно во время секса, это нормально?",
+        "Мне больно во время секса, это нормально?",
+    ),
+    (
+        "Мне 15 лет, можно ли заниматься сексом с парнем?",
+        "Мне 25 лет, можно ли заниматься сексом с парнем?",
+    ),
+]
+
+
+@pytest.mark.parametrize("cached, asked", OPPOSITE_PAIRS + [(b, a) for a, b in OPPOSITE_PAIRS])
+def test_numbers_and_negations_are_not_near_duplicates(cached, asked):
+    cache = ResponseCache()
+    cache.put(PROMPT, cached, "ответ")
+    assert cache.get(PROMPT, asked) is None
+    assert cache.near_hits == 0
+
+
+def test_near_duplicate_hits():
+    cache = ResponseCache()
+    cache.put(PROMPT, "Мне 25 лет, как перестать тревожиться перед первым свиданием с девушкой?", "ответ")
+    asked = "мне 25 лет как перестать тревожиться перед первым свиданием с девушкой пожалуйста"
+    assert cache.get(PROMPT, asked) == "ответ"
+    assert cache.near_hits == 1
+
+
+def test_exact_match_ignores_case_and_punctuation():
+    cache = ResponseCache()
+    cache.put(PROMPT, "Что такое тревога?", "ответ")
+    assert cache.get(PROMPT, "что такое ТРЕВОГА") == "ответ"
+    assert cache.hits == 1
+
+
+def test_guard_tokens():
+    assert guard_tokens(normalize("Мне 15 лет, и я не знаю, нет ли ни одной причины")) == {"15", "не", "нет", "ни"}
+    assert guard_tokens(normalize("Нечего сказать, никто не поймёт")) == {"не"}
@@ -0,0 +1,49 @@
+import logging
+from functools import lru_cache
+from typing import Dict, List
+
+try:
+    import tiktoken
+except ImportError:  # без tiktoken считаем приблизительно
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Служебные токены на каждое сообщение в chat-формате
+MESSAGE_OVERHEAD = 4
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Словарь токенизатора скачивается при первом использовании и может быть недоступен
+        logger.warning(f"tiktoken недоступен, токены считаются приблизительно: {e}")
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценка сверху без токенизатора: 3 байта UTF-8 на токен, то есть около
+    3 символов латиницы или 1,5 символа кириллицы на токен.
+    """
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Число токенов в тексте. Без tiktoken — оценка сверху, чтобы не переполнить контекстное окно."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str = "gpt-3.5-turbo") -> int:
+    """Размер списка сообщений для ChatCompletion в токенах."""
+    return sum(count_tokens(message["content"], model) + MESSAGE_OVERHEAD for message in messages) + 3
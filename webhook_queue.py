@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class SeenUpdates:
+    """Множество уже принятых update_id с ограничением по времени жизни и размеру."""
+
+    def __init__(self, ttl: float = 600.0, max_size: int = 100_000) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: "OrderedDict[int, float]" = OrderedDict()
+
+    def _expire(self, now: float) -> None:
+        # Записи упорядочены по времени добавления, поэтому чистим с начала
+        while self._items:
+            update_id, added_at = next(iter(self._items.items()))
+            if now - added_at < self.ttl and len(self._items) <= self.max_size:
+                break
+            self._items.popitem(last=False)
+
+    def add(self, update_id: int) -> bool:
+        """Запоминает update_id. Возвращает False, если он уже встречался."""
+        now = time.monotonic()
+        self._expire(now)
+        if update_id in self._items:
+            return False
+        self._items[update_id] = now
+        return True
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик вебхука, который сразу отвечает Telegram 200 OK,
+    а сам апдейт кладёт в ограниченную очередь для фоновых воркеров.
+    Повторные доставки с тем же update_id отбрасываются. Если очередь
+    заполнена, Telegram получает 503 и доставит апдейт повторно.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        queue_size: int = 1000,
+        workers: int = 8,
+        dedup_ttl: float = 600.0,
+        **data: Any,
+    ) -> None:
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **data)
+        self.queue_size = queue_size
+        self.workers = workers
+        self.seen = SeenUpdates(ttl=dedup_ttl)
+        self.rejected = 0
+        self.duplicates = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> Dict[str, int]:
+        """Текущее состояние очереди для мониторинга."""
+        return {
+            "queue_depth": self.queue_depth,
+            "queue_size": self.queue_size,
+            "rejected": self.rejected,
+            "duplicates": self.duplicates,
+        }
+
+    def register(self, app: web.Application, /, path: str, **kwargs: Any) -> None:
+        app.on_startup.append(self._handle_start)
+        super().register(app, path=path, **kwargs)
+
+    async def _handle_start(self, app: web.Application) -> None:
+        await self.start()
+
+    async def start(self) -> None:
+        """Запуск фоновых воркеров"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"webhook-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"Очередь вебхуков запущена: {self.workers} воркеров, размер {self.queue_size}")
+
+    async def close(self) -> None:
+        """Дожидаемся разбора очереди, останавливаем воркеры и закрываем сессию бота"""
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=10)
+            except asyncio.TimeoutError:
+                logger.warning(f"Очередь вебхуков не разобрана при остановке: {self.queue_depth}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await super().close()
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        while True:
+            bot, update = await self._queue.get()
+            try:
+                result = await self.dispatcher.feed_raw_update(bot=bot, update=update, **self.data)
+                if isinstance(result, TelegramMethod):
+                    await self.dispatcher.silent_call_request(bot=bot, result=result)
+            except Exception as e:
+                logger.error(f"Ошибка обработки апдейта {update.get('update_id')}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        update_id = update.get("update_id")
+
+        if self._queue is None:
+            await self.start()
+        if self._queue.full():
+            # update_id не запоминаем: Telegram повторит доставку, и апдейт не потеряется
+            self.rejected += 1
+            logger.warning(f"Очередь вебхуков переполнена, апдейт {update_id} вернётся повторной доставкой")
+            return web.json_response({}, status=503, dumps=bot.session.json_dumps)
+
+        response = web.json_response({}, dumps=bot.session.json_dumps)
+        if update_id is not None and not self.seen.add(update_id):
+            self.duplicates += 1
+            logger.info(f"Повторная доставка апдейта {update_id}, пропускаю")
+            return response
+
+        self._queue.put_nowait((bot, update))
+        return response